@@ -1,31 +1,26 @@
 import streamlit as st
 import polars as pl
-import base64
-import os
-import sys
 from utils.data_processing import (
-    get_data,
-    decrypt_dataframe,
-    get_unique_kommuner,
-    get_unique_categories,
-    filter_dataframe_by_choice,
-    filter_dataframe_by_category,
+    load_decrypted_data,
+    load_dropdown_options,
+    build_filtered_lazyframe,
     generate_organization_links,
-    filter_df_by_search,
     fix_column_types_and_sort,
     format_number_european,
     round_to_million_or_billion,
+    summarize_priorities,
     get_ai_text,
-    to_excel_function,
+    build_excel_for_filters,
     load_css,
+    load_image,
     write_markdown_sidebar,
     format_and_display_data,
     display_dataframe,
     create_user_session_log,
-    cache_data_for_hele_landet,
-    cache_excel_for_hele_landet,
+    select_page,
+    PAGE_SIZE,
 )
-from utils.plots import create_pie_chart
+from utils.plots import create_pie_chart, get_type_distribution
 from config import set_pandas_options, set_streamlit_options
 
 # Apply the settings
@@ -33,25 +28,11 @@ set_pandas_options()
 set_streamlit_options()
 load_css("webapp/style.css")
 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-
 create_user_session_log("Forside")
 
-if "df_pl" not in st.session_state:
-    with st.spinner("Klargør side..."):
-        df_retrieved = get_data()
-
-        encoded_key = os.getenv("ENCRYPTION_KEY")
-
-        if encoded_key is None:
-            raise ValueError("ENCRYPTION_KEY is not set in the environment variables.")
+df_pl = load_decrypted_data()
 
-        encryption_key = base64.b64decode(encoded_key)
-
-        col_list = ["Område", "ISIN kode", "Værdipapirets navn"]
-        st.session_state.df_pl = decrypt_dataframe(df_retrieved, encryption_key, col_list)
-
-st.logo("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png")
+st.logo(load_image("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png"))
 
 # Title of the app
 st.title("Kommunernes og regionernes investeringer")
@@ -110,11 +91,8 @@ with st.expander("Sådan kommer du i gang.", icon="❔"):
     """
     )
 
-# Get unique municipalities and sort alphabetically
-dropdown_options = get_unique_kommuner(st.session_state.df_pl)
-
-# Get list of categories/reasons
-unique_categories_list = get_unique_categories(st.session_state.df_pl)
+# Get unique municipalities sorted alphabetically and the list of categories/reasons
+dropdown_options, unique_categories_list = load_dropdown_options()
 
 # Costum choice for dropdown
 all_values = "Hele landet"
@@ -150,43 +128,52 @@ with st.sidebar:
         unsafe_allow_html=True,
     )
 
-    # Filter dataframe based on user's selection
-    filtered_df = filter_dataframe_by_choice(st.session_state.df_pl, user_choice)
+    # Build one lazy query carrying all of the user's filters
+    lf = build_filtered_lazyframe(df_pl, user_choice, search_query, selected_categories)
 
-    filtered_df = filter_df_by_search(filtered_df, search_query)
+    # Evaluate the kommune count and the pie chart's type distribution together with the
+    # filtered dataframe, so the filters are only applied once. The streaming engine processes
+    # the rows in batches, which keeps the memory use down for "Hele landet"
+    count_kommuner_df, type_distribution, filtered_df = pl.collect_all(
+        [lf.select(pl.col("Område").n_unique()), get_type_distribution(lf), lf],
+        engine="streaming",
+    )
 
-    filtered_df = filter_dataframe_by_category(filtered_df, selected_categories)
+    count_kommuner = count_kommuner_df.item()
 
-    filtered_df = fix_column_types_and_sort(filtered_df)
+    # Count and sum the investments per 'Priority' in one pass
+    priority_counts, priority_sums = summarize_priorities(filtered_df)
 
     if user_choice in [all_values, municipalities, regions] and search_query or selected_categories:
         if search_query:
             st.markdown(
-                f"Antal kommuner/regioner, hvor '{search_query}' indgår: \n **{filtered_df.select(pl.col("Område").n_unique()).to_numpy()[0][0]}**"
+                f"Antal kommuner/regioner, hvor '{search_query}' indgår: \n **{count_kommuner}**"
             )
         else:
             st.markdown(
-                f"Antal kommuner/regioner, der fremgår efter filtrering: \n **{filtered_df.select(pl.col("Område").n_unique()).to_numpy()[0][0]}**"
+                f"Antal kommuner/regioner, der fremgår efter filtrering: \n **{count_kommuner}**"
             )
 
     write_markdown_sidebar()
 
-# Conditionally display the header based on whether a search query is provided
-if selected_categories:
-    select_string = ", ".join(selected_categories)
-if search_query and not selected_categories:
-    st.markdown(f'Data for "{user_choice}" og "{search_query}":')
-if selected_categories and not search_query:
-    st.subheader(f'Data for "{user_choice}" og "{select_string}":')
-if selected_categories and search_query:
-    st.subheader(f'Data for "{user_choice}", "{select_string}" og "{search_query}":')
-if not selected_categories and not search_query:
-    if user_choice == "Hele landet":
-        st.markdown(
-            f"### Data for alle kommuner og regioner: \n ##### (Vælg en enkelt kommune eller region i panelet til venstre)"
-        )
+# Display one header for the selected area, categories and search query
+if user_choice == all_values and not selected_categories and not search_query:
+    st.markdown(
+        f"### Data for alle kommuner og regioner: \n ##### (Vælg en enkelt kommune eller region i panelet til venstre)"
+    )
+else:
+    header_parts = [f'"{user_choice}"']
+    if selected_categories:
+        header_parts.append(f'"{", ".join(selected_categories)}"')
+    if search_query:
+        header_parts.append(f'"{search_query}"')
+
+    # Join as 'A og B' or 'A, B og C'
+    if len(header_parts) > 1:
+        header = ", ".join(header_parts[:-1]) + " og " + header_parts[-1]
     else:
-        st.subheader(f'Data for "{user_choice}":')
+        header = header_parts[0]
+    st.subheader(f"Data for {header}:")
 
 # Create three columns
 col1, col2 = st.columns([0.4, 0.6])
@@ -196,7 +183,7 @@ with col1:
     if filtered_df.shape[0] == 0:
         st.subheader(f"**Der er ingen værdipapirer/investeringer.**")
     else:
-        create_pie_chart(filtered_df)
+        create_pie_chart(type_distribution)
 
 # Column 2: Number of problematic investments
 with col2:
@@ -207,18 +194,18 @@ with col2:
             unsafe_allow_html=True,
         )
 
-        # Count the rows where 'Problematisk ifølge:' is not empty
-        problematic_count = filtered_df.filter(filtered_df["Priority"].is_in([2, 3])).shape[0]
-        problematic_count = format_number_european(problematic_count)
+        # Count the rows per 'Priority' - red (3) and orange (2) are the problematic ones
+        problematic_count_red = int(priority_counts[3])
+        problematic_count_orange = int(priority_counts[2])
+        problematic_count_yellow = int(priority_counts[1])
+
+        problematic_count = format_number_european(problematic_count_red + problematic_count_orange)
         st.markdown(
             f'<h2 style="color:black; text-align:center;">{problematic_count}</h2>',
             unsafe_allow_html=True,
         )
 
-        problematic_count_red = filtered_df.filter(filtered_df["Priority"] == 3).shape[0]
         problematic_count_red = format_number_european(problematic_count_red)
-
-        problematic_count_orange = filtered_df.filter(filtered_df["Priority"] == 2).shape[0]
         problematic_count_orange = format_number_european(problematic_count_orange)
 
         # Using HTML to style text with color
@@ -228,7 +215,6 @@ with col2:
             unsafe_allow_html=True,
         )
 
-        problematic_count_yellow = filtered_df.filter(filtered_df["Priority"] == 1).shape[0]
         problematic_count_yellow = format_number_european(problematic_count_yellow)
 
         # Using HTML to style text with color
@@ -248,19 +234,14 @@ with col2:
         st.write(f"**Antal investeringer:** {antal_inv}")
 
         # Calculate the total sum of 'Markedsværdi (DKK)' and display it in both DKK and millions
-        total_markedsvaerdi = (
-            filtered_df.select(pl.sum("Markedsværdi (DKK)")).to_pandas().iloc[0, 0]
-        ).astype(int)
+        total_markedsvaerdi = int(priority_sums.sum())
 
         markedsvaerdi_euro = format_number_european(total_markedsvaerdi)
         markedsvaerdi_euro_short = round_to_million_or_billion(total_markedsvaerdi, 1)
         st.write(f"**Total markedsværdi (DKK):** {markedsvaerdi_euro} {markedsvaerdi_euro_short}")
 
-        # Filter for problematic investments and calculate the total sum of their 'Markedsværdi (DKK)'
-        prob_df = filtered_df.filter(filtered_df["Priority"].is_in([2, 3]))
-        prob_markedsvaerdi = (
-            prob_df.select(pl.sum("Markedsværdi (DKK)")).to_pandas().iloc[0, 0]
-        ).astype(int)
+        # The total sum of 'Markedsværdi (DKK)' for the problematic investments
+        prob_markedsvaerdi = int(priority_sums[2] + priority_sums[3])
 
         prob_markedsvaerdi_euro = format_number_european(prob_markedsvaerdi)
         prob_markedsvaerdi_euro_short = round_to_million_or_billion(prob_markedsvaerdi, 1)
@@ -268,15 +249,18 @@ with col2:
             f"**Markedsværdi af problematiske investeringer (DKK):** {prob_markedsvaerdi_euro} {prob_markedsvaerdi_euro_short}"
         )
 
+
+# Changing page only reruns this fragment, not the filters, chart and numbers above
+@st.fragment
+def display_table_page(filtered_df):
+    # Only the selected page is sorted, formatted and sent to the browser
+    offset = select_page(filtered_df.height)
+    page_df = fix_column_types_and_sort(filtered_df.lazy()).slice(offset, PAGE_SIZE).collect()
+    display_dataframe(format_and_display_data(page_df))
+
+
 with st.spinner("Henter data.."):
-    if user_choice == "Hele landet" and selected_categories == [] and search_query == "":
-        # Cache the data for "Hele landet"
-        hele_landet_data = cache_data_for_hele_landet(filtered_df)
-        display_dataframe(hele_landet_data)
-    else:
-        # No caching for other cases
-        display_df = format_and_display_data(filtered_df)
-        display_dataframe(display_df)
+    display_table_page(filtered_df)
 
 
 st.markdown(
@@ -289,32 +273,15 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-filtered_df = filtered_df.to_pandas()
-filtered_df.drop("Priority", axis=1, inplace=True)
-
-
-with st.spinner("Klargør download til Excel.."):
-    if user_choice == "Hele landet" and selected_categories == [] and search_query == "":
-        # Cache and create the Excel file for "Hele landet"
-        hele_landet_excel = cache_excel_for_hele_landet(filtered_df)
-        
-        # Create a download button for the Excel file
-        st.download_button(
-            label="Download til Excel",
-            data=hele_landet_excel,
-            file_name=f"Investeringer for {user_choice}{search_query}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
-    else:
-        excel_data = to_excel_function(filtered_df)
-
-        # Create a download button
-        st.download_button(
-            label="Download til Excel",
-            data=excel_data,
-            file_name=f"Investeringer for {user_choice}{search_query}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+# The Excel file is only built when the button is clicked, and cached per filter
+st.download_button(
+    label="Download til Excel",
+    data=lambda: build_excel_for_filters(user_choice, search_query, tuple(selected_categories)),
+    file_name=f"Investeringer for {user_choice}{search_query}.xlsx",
+    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+)
+# There is no spinner while the file is built, so large selections are announced up front
+st.caption("Store udtræk, fx for hele landet, kan tage lidt tid at klargøre efter klik.")
 
 with st.spinner("Henter AI-tekster.."):
     if user_choice not in [all_values, municipalities, regions, samsø, læsø]:
@@ -1,24 +1,25 @@
 import streamlit as st
 import polars as pl
-import base64
-import os
 from utils.data_processing import (
-    get_data,
-    decrypt_dataframe,
+    load_decrypted_data,
     filter_df_by_search,
     fix_column_types_and_sort,
     format_number_european,
+    format_number_european_expr,
+    format_and_display_data,
     round_to_million_or_billion,
-    get_unique_categories,
-    get_unique_kommuner,
+    load_dropdown_options,
     filter_dataframe_by_category,
     filter_dataframe_by_multiple_choices,
     to_excel_function,
     load_css,
+    load_image,
     write_markdown_sidebar,
     create_user_session_log,
     generate_organization_links,
     display_dataframe,
+    select_page,
+    PAGE_SIZE,
 )
 from config import set_pandas_options, set_streamlit_options
 from datetime import datetime
@@ -29,23 +30,11 @@ create_user_session_log("Avanceret søgning")
 set_pandas_options()
 set_streamlit_options()
 
-st.logo("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png")
+st.logo(load_image("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png"))
 
 load_css("webapp/style.css")
 
-if "df_pl" not in st.session_state:
-    with st.spinner("Klargør side..."):
-        df_retrieved = get_data()
-
-        encoded_key = os.getenv("ENCRYPTION_KEY")
-
-        if encoded_key is None:
-            raise ValueError("ENCRYPTION_KEY is not set in the environment variables.")
-
-        encryption_key = base64.b64decode(encoded_key)
-
-        col_list = ["Område", "ISIN kode", "Værdipapirets navn"]
-        st.session_state.df_pl = decrypt_dataframe(df_retrieved, encryption_key, col_list)
+df_pl = load_decrypted_data()
 
 
 with st.sidebar:
@@ -55,9 +44,7 @@ with st.sidebar:
 st.header("Søg videre i databasen")
 
 default_priorities = [2, 3]
-unique_categories_list = get_unique_categories(st.session_state.df_pl)
-
-dropdown_areas = get_unique_kommuner(st.session_state.df_pl)
+dropdown_areas, unique_categories_list = load_dropdown_options()
 
 to_be_removed = {"Alle kommuner", "Alle regioner", "Hele landet"}
 dropdown_areas = [item for item in dropdown_areas if item not in to_be_removed]
@@ -124,18 +111,12 @@ with st.expander("Disse områder har ingen problematiske investeringer:"):
 
 # Filter the dataframe by selected priorities and search query
 filtered_df = (
-    st.session_state.df_pl.filter(
-        (
-            st.session_state.df_pl["Priority"].is_in(
-                [p for p in selected_priorities if p is not None]
-            )
-        )
-        | (st.session_state.df_pl["Priority"].is_null())
+    df_pl.filter(
+        (df_pl["Priority"].is_in([p for p in selected_priorities if p is not None]))
+        | (df_pl["Priority"].is_null())
     )
     if None in selected_priorities
-    else st.session_state.df_pl.filter(
-        st.session_state.df_pl["Priority"].is_in(selected_priorities)
-    )
+    else df_pl.filter(df_pl["Priority"].is_in(selected_priorities))
 )
 
 filtered_df = filter_dataframe_by_multiple_choices(filtered_df, selected_areas)
@@ -161,9 +142,7 @@ def get_municipalities(filtered_df, sort_by_col, top_n=None):
 
     # Format the 'Total Markedsværdi (DKK)' column to European formatting
     kommune_summary = kommune_summary.with_columns(
-        pl.col("Total Markedsværdi (DKK)").map_elements(
-            format_number_european, return_dtype=pl.Utf8
-        )
+        format_number_european_expr(pl.col("Total Markedsværdi (DKK)"))
     )
 
     # If top_n is set, return only the top_n rows
@@ -218,11 +197,11 @@ st.write("##### Data baseret på søgning/filtre:")
 with st.container(border=True):
     # Display search results
     st.markdown(
-        f"***Antallet af kommuner/regioner:*** \n **{filtered_df.select(pl.col('Område').n_unique()).to_numpy()[0][0]}**"
+        f"***Antallet af kommuner/regioner:*** \n **{filtered_df.select(pl.col('Område').n_unique()).item()}**"
     )
 
     # Calculate the sum of all investments in the "Markedsværdi (DKK)" column
-    investment_sum = filtered_df.select(pl.col("Markedsværdi (DKK)").sum()).to_numpy()[0][0]
+    investment_sum = filtered_df.select(pl.col("Markedsværdi (DKK)").sum()).item()
 
     # Create the conditional text for the sum
     if search_query or selected_categories:
@@ -234,13 +213,17 @@ with st.container(border=True):
     st.markdown(f"{sum_text}")
 
 
-display_df = filtered_df.with_columns(
-    pl.col("Markedsværdi (DKK)")
-    .map_elements(format_number_european, return_dtype=pl.Utf8)
-    .alias("Markedsværdi (DKK)"),
-)
+display_df = format_and_display_data(filtered_df)
+
+
+# Changing page only reruns this fragment, not the filtering and Excel file above and below
+@st.fragment
+def display_table_page(display_df):
+    offset = select_page(display_df.height)
+    display_dataframe(display_df.slice(offset, PAGE_SIZE))
+
 
-display_dataframe(display_df)
+display_table_page(display_df)
 
 st.markdown(
     "\\* *Markedsværdien (DKK) er et øjebliksbillede. Tallene er oplyst af kommunerne og regionerne selv ud fra deres senest opgjorte opgørelser.*"
@@ -252,8 +235,7 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-display_df = display_df.to_pandas()
-display_df.drop("Priority", axis=1, inplace=True)
+display_df = display_df.drop("Priority")
 
 # Convert dataframe to Excel
 excel_data = to_excel_function(display_df)
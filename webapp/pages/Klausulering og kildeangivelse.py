@@ -1,10 +1,15 @@
 import streamlit as st
 from config import set_pandas_options, set_streamlit_options
-from utils.data_processing import load_css, write_markdown_sidebar, create_user_session_log
+from utils.data_processing import (
+    load_css,
+    load_image,
+    write_markdown_sidebar,
+    create_user_session_log,
+)
 
 create_user_session_log("Klausulering og kildeangivelse")
 
-st.logo("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png")
+st.logo(load_image("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png"))
 
 # Apply the settings
 set_pandas_options()
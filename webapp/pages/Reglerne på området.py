@@ -1,6 +1,11 @@
 import streamlit as st
 from config import set_pandas_options, set_streamlit_options
-from utils.data_processing import load_css, write_markdown_sidebar, create_user_session_log
+from utils.data_processing import (
+    load_css,
+    load_image,
+    write_markdown_sidebar,
+    create_user_session_log,
+)
 
 create_user_session_log("Reglerne på området")
 
@@ -9,7 +14,7 @@ set_pandas_options()
 set_streamlit_options()
 
 load_css("webapp/style.css")
-st.logo("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png")
+st.logo(load_image("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png"))
 
 with st.sidebar:
     write_markdown_sidebar()
@@ -1,11 +1,10 @@
 import babel.numbers
 from sqlalchemy import create_engine
 import polars as pl
-import pandas as pd
+import numpy as np
 import streamlit as st
 import re
 import os
-from datetime import timedelta
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
@@ -15,7 +14,6 @@ import uuid
 from datetime import datetime
 
 
-@st.cache_data(show_spinner="Indlæser data")  # , ttl=timedelta(hours=10)
 def get_data():
     engine = create_engine(
         "sqlite:///data/investerings_database_encrypted_new.db"
@@ -42,9 +40,7 @@ def get_data():
     with engine.connect() as conn:
         df_polars = pl.read_database(query, conn)
 
-    df_pandas = df_polars.to_pandas()
-
-    return df_pandas
+    return df_polars
 
 
 # Decrypt data using AES-CBC mode
@@ -70,31 +66,55 @@ def aes_decrypt(encrypted_data, key):
 
 
 # Function to decrypt specified columns of the DataFrame using AES-CBC
-@st.cache_data(show_spinner="Dekrypterer data", ttl=timedelta(hours=10))
 def decrypt_dataframe(df, key, col_list):
-    df_decrypted = df.copy()  # Create a copy of the DataFrame
+    # Decrypt directly on the Polars DataFrame, non-string columns are cast to string first.
+    # Null values are skipped by map_elements and stay null
+    df_decrypted = df.with_columns(
+        [
+            pl.col(col)
+            .cast(pl.Utf8)
+            .map_elements(lambda x: aes_decrypt(x, key), return_dtype=pl.Utf8)
+            for col in col_list
+        ]
+    )
 
-    for col in col_list:
-        if pd.api.types.is_string_dtype(df_decrypted[col]):
-            # Decrypt string columns
-            df_decrypted[col] = df_decrypted[col].apply(lambda x: aes_decrypt(x, key))
-        else:
-            # Convert to the original data type after decryption
-            df_decrypted[col] = df_decrypted[col].apply(lambda x: aes_decrypt(str(x), key))
+    return df_decrypted
 
-    df_decrypted = pl.from_pandas(df_decrypted)
 
-    return df_decrypted
+CATEGORICAL_COLUMNS = ["Område", "Type", "Problematisk ifølge:"]
+
+
+# Load and decrypt the data once per server process. cache_resource shares the same
+# DataFrame between all sessions instead of decrypting it again for every new user
+@st.cache_resource(show_spinner="Klargør side...")
+def load_decrypted_data():
+    df_retrieved = get_data()
+
+    encoded_key = os.getenv("ENCRYPTION_KEY")
 
-# Cache the data formatting and display function with _ to skip hashing the dataframe
-@st.cache_data
-def cache_data_for_hele_landet(_filtered_df):
-    return format_and_display_data(_filtered_df)
+    if encoded_key is None:
+        raise ValueError("ENCRYPTION_KEY is not set in the environment variables.")
+
+    encryption_key = base64.b64decode(encoded_key)
+
+    col_list = ["Område", "ISIN kode", "Værdipapirets navn"]
+    df_decrypted = decrypt_dataframe(df_retrieved, encryption_key, col_list)
+
+    # Columns with few distinct values are stored as categoricals (dictionary encoded), so
+    # filters compare integer codes instead of strings. 'Priority' is only null, 1, 2 or 3
+    return df_decrypted.with_columns(
+        [pl.col(col).cast(pl.Categorical) for col in CATEGORICAL_COLUMNS]
+        + [pl.col("Priority").cast(pl.Int8)]
+    )
+
+
+# The dropdown options only change when the data is reloaded, so they are computed once per
+# server process from the shared DataFrame
+@st.cache_resource(show_spinner=False)
+def load_dropdown_options():
+    df_pl = load_decrypted_data()
+    return get_unique_kommuner(df_pl), get_unique_categories(df_pl)
 
-# Cache the Excel generation function with _ to skip hashing the dataframe
-@st.cache_data
-def cache_excel_for_hele_landet(_filtered_df):
-    return to_excel_function(_filtered_df)
 
 def get_ai_text(area):
     table_name = os.getenv("TABLE_NAME_AI")
@@ -105,7 +125,7 @@ def get_ai_text(area):
         query = f"SELECT [Resumé] FROM {table_name} WHERE `Kommune` = '{area}';"  # Example query
 
         # Execute the query and load the result into a Polars DataFrame
-        result_df = pd.read_sql(query, conn)
+        result_df = pl.read_database(query, conn)
     return result_df["Resumé"][0]
 
 
@@ -115,6 +135,23 @@ def format_number_european(value, digits=0):
     return babel.numbers.format_decimal(value, locale="da_DK")
 
 
+# Vectorized version of format_number_european (with digits=0) for a whole column. Groups the
+# thousands with "." by reversing the digits, so it runs in Polars instead of calling
+# babel for every row
+def format_number_european_expr(col):
+    rounded = col.round(0).cast(pl.Int64)
+    digits = (
+        rounded.abs()
+        .cast(pl.Utf8)
+        .str.reverse()
+        .str.replace_all(r"(\d{3})", "$1.")
+        .str.strip_chars_end(".")
+        .str.reverse()
+    )
+    # The when/then output takes its name from the first branch, so keep the column name there
+    return pl.when(rounded >= 0).then(digits).otherwise(pl.concat_str(pl.lit("-"), digits))
+
+
 def round_to_million_or_billion(value, digits=2):
     value = int(value)
 
@@ -134,6 +171,19 @@ def round_to_million_or_billion(value, digits=2):
         return ""
 
 
+def summarize_priorities(df):
+    """
+    Count the rows and sum 'Markedsværdi (DKK)' per 'Priority' in one vectorized pass.
+    Returns two NumPy arrays indexed by priority, where index 0 holds the rows without one.
+    """
+    priority = df.get_column("Priority").fill_null(0).cast(pl.Int8).to_numpy()
+    markedsvaerdi = df.get_column("Markedsværdi (DKK)").fill_null(0).to_numpy()
+
+    counts = np.bincount(priority, minlength=4)
+    sums = np.bincount(priority, weights=markedsvaerdi, minlength=4)
+    return counts, sums
+
+
 def get_unique_kommuner(df_pl):
     """
     Extract unique 'Kommune' values from the dataframe and sort them alphabetically.
@@ -177,23 +227,27 @@ def filter_dataframe_by_choice(
 ):
     """
     Filter the dataframe based on the user's selection (all_values, municipalities, regions, or a specific kommune).
+    Works on both a DataFrame and a LazyFrame.
     """
     if choice == all_values:
         return df_pl
     elif choice == municipalities:
-        return df_pl.filter(~df_pl["Område"].str.starts_with("Region"))
+        return df_pl.filter(~pl.col("Område").cast(pl.Utf8).str.starts_with("Region"))
     elif choice == regions:
-        return df_pl.filter(df_pl["Område"].str.starts_with("Region"))
+        return df_pl.filter(pl.col("Område").cast(pl.Utf8).str.starts_with("Region"))
     else:
-        return df_pl.filter(df_pl["Område"] == choice)
+        return df_pl.filter(pl.col("Område") == choice)
 
 
 def filter_dataframe_by_category(df, selected_categories):
     if selected_categories:
         # Filter rows where any of the selected categories are in 'Problemkategori'
         df_filtered = df.filter(
-            pl.col("Problemkategori").map_elements(
-                lambda x: any(cat in x for cat in selected_categories), return_dtype=pl.Boolean
+            pl.any_horizontal(
+                [
+                    pl.col("Problemkategori").str.contains(cat, literal=True)
+                    for cat in selected_categories
+                ]
             )
         )
     else:
@@ -245,27 +299,22 @@ def filter_df_by_search(df, search_query):
         # Normalize the search query by removing special characters but keeping spaces normalized
         normalized_search_query = normalize_text(search_query)
 
-        # Replace NA values with empty strings and cast columns to string
-        df = df.with_columns([pl.col(col).fill_null("").cast(str) for col in df.columns])
-
-        # Combine conditions across all columns using logical OR (|) operator
-        filter_expr = None
-        for col in df.columns:
-            # Normalize the text in each column for comparison
-            normalized_col = (
-                pl.col(col)
-                .str.replace_all(r"[^\w\s]", " ")  # Replace non-alphanumeric chars with space
-                .str.to_lowercase()  # Convert to lowercase
-                .str.replace_all(r"\s+", " ")  # Collapse multiple spaces
-                .str.strip_chars()  # Trim leading and trailing spaces
-            )
-
-            # Check if the normalized column contains the normalized search query
-            condition = normalized_col.str.contains(normalized_search_query)
-            filter_expr = condition if filter_expr is None else filter_expr | condition
-
-        # Apply the filter
-        filtered_df = df.filter(filter_expr)
+        # Normalize the text in each column and check if it contains the normalized search query.
+        # The query has no special characters left, so it is matched literally without a regex
+        conditions = [
+            pl.col(col)
+            .cast(pl.Utf8)
+            .fill_null("")  # Replace NA values with empty strings
+            .str.replace_all(r"[^\w\s]", " ")  # Replace non-alphanumeric chars with space
+            .str.to_lowercase()  # Convert to lowercase
+            .str.replace_all(r"\s+", " ")  # Collapse multiple spaces
+            .str.strip_chars()  # Trim leading and trailing spaces
+            .str.contains(normalized_search_query, literal=True)
+            for col in df.collect_schema().names()
+        ]
+
+        # Keep the rows where any of the columns match
+        filtered_df = df.filter(pl.any_horizontal(conditions))
 
     else:
         filtered_df = df
@@ -273,12 +322,15 @@ def filter_df_by_search(df, search_query):
     return filtered_df
 
 
-# Function to check if a value can be converted to float
-def to_float_safe(val):
-    try:
-        return float(val)
-    except ValueError:
-        return None
+def build_filtered_lazyframe(df_pl, choice, search_query, selected_categories):
+    """
+    Chain the area, search and category filters from the Forside on a LazyFrame.
+    """
+    lf = df_pl.lazy()
+    lf = filter_dataframe_by_choice(lf, choice)
+    lf = filter_df_by_search(lf, search_query)
+    lf = filter_dataframe_by_category(lf, selected_categories)
+    return lf
 
 
 def fix_column_types_and_sort(df):
@@ -288,8 +340,8 @@ def fix_column_types_and_sort(df):
     # Cast 'Sortlistet' to integer
     df = df.with_columns([pl.col("Sortlistet").cast(pl.Int32)])
 
-    # Apply the function - to_float_safe -to the column
-    df = df.with_columns(pl.col("Priority").map_elements(to_float_safe, return_dtype=pl.Float64))
+    # Cast 'Priority' to a small integer
+    df = df.with_columns([pl.col("Priority").cast(pl.Int8)])
 
     # Sort first by 'Sortlistet', then by 'Priority', followed by 'Kommune' and 'ISIN kode'
     filtered_df = df.sort(
@@ -307,6 +359,32 @@ def fix_column_types_and_sort(df):
 
 # Function to generate a single line with links
 def generate_organization_links(df, column_name):
+    # Extract all unique organizations from the dataframe column. The distinct values are found
+    # before splitting, so only a few hundred strings are split instead of every row
+    unique_orgs = (
+        df.lazy()
+        .select(
+            pl.col(column_name)
+            .drop_nulls()
+            .unique()
+            .cast(pl.Utf8)
+            .str.split("; ")
+            .explode()
+            .str.strip_chars()
+            .unique()
+        )
+        .collect()
+        .get_column(column_name)
+        .to_list()
+    )
+
+    # Display the bold title and links
+    st.markdown(organization_links_markdown(tuple(sorted(unique_orgs))))
+
+
+# The markdown only depends on the set of organizations, so it is cached on that
+@st.cache_data(show_spinner=False)
+def organization_links_markdown(orgs):
     org_links = {
         "Akademiker Pension": "https://akademikerpension.dk/ansvarlighed/frasalg-og-eksklusion/",
         "AP Pension": "https://appension.dk/globalassets/content_mz/filer-pdf/investering/eksklusionsliste.pdf",
@@ -332,35 +410,58 @@ def generate_organization_links(df, column_name):
         "Sydinvenst": "https://www.sydinvest.dk/investeringsforening/ansvarlighed/eksklusionsliste-selskaber",
         "Velliv": "https://www.velliv.dk/dk/privat/om-os/samfundsansvar/ansvarlige-investeringer/vores-holdninger",  # "https://www.velliv.dk/media/5102/eksklusionslisten-31012024.pdf",
     }
-    # Extract all unique organizations from the dataframe column
-    unique_orgs = set()
-
-    for org_list in df[column_name]:
-        if org_list is not None:
-            orgs = org_list.split("; ")
-            for org in orgs:
-                unique_orgs.add(org.strip())
-
     # Generate the links as one line
-    links = "; ".join([f"[{org}]({org_links[org]})" for org in unique_orgs if org in org_links])
+    links = "; ".join([f"[{org}]({org_links[org]})" for org in orgs if org in org_links])
 
-    # Display the bold title and links
-    st.markdown(f"**Links til seneste relevante eksklusionslister:** {links}")
+    return f"**Links til seneste relevante eksklusionslister:** {links}"
 
 
-# Function to convert dataframe to Excel and create a downloadable file
+# Function to convert a Polars dataframe to Excel and create a downloadable file
 def to_excel_function(filtered_df):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        filtered_df.to_excel(writer, index=False)
+    # Categoricals are written as their string values
+    filtered_df = filtered_df.with_columns(pl.col(pl.Categorical).cast(pl.Utf8))
+    # Numbers are written without number formats or table styling, like the old pandas export
+    filtered_df.write_excel(
+        output,
+        dtype_formats={
+            dtype: "General" for dtype in filtered_df.schema.values() if dtype.is_numeric()
+        },
+        table_style=None,
+        autofilter=False,
+    )
     processed_data = output.getvalue()
     return processed_data
 
 
+# Build the Excel file for a set of Forside filters. The arguments are all hashable, so each
+# distinct filter is only written to Excel once and reused from the cache afterwards
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_excel_for_filters(choice, search_query, selected_categories):
+    lf = build_filtered_lazyframe(
+        load_decrypted_data(), choice, search_query, list(selected_categories)
+    )
+    filtered_df = fix_column_types_and_sort(lf).drop("Priority").collect(engine="streaming")
+    return to_excel_function(filtered_df)
+
+
+# Read the CSS file once per process instead of on every rerun
+@st.cache_data(show_spinner=False)
+def read_css(file_name):
+    with open(file_name) as f:
+        return f.read()
+
+
 # Function to load and inject CSS into the Streamlit app
 def load_css(file_name):
-    with open(file_name) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    st.markdown(f"<style>{read_css(file_name)}</style>", unsafe_allow_html=True)
+
+
+# Read an image file once per process, shared between all sessions
+@st.cache_resource(show_spinner=False)
+def load_image(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
 
 
 def write_markdown_sidebar(how_we_did=False):
@@ -381,7 +482,7 @@ def write_markdown_sidebar(how_we_did=False):
         ),
         unsafe_allow_html=True,
     )
-    st.image("webapp/images/vaerdipapirer_01_1200x630.jpg")
+    st.image(load_image("webapp/images/vaerdipapirer_01_1200x630.jpg"))
 
     st.markdown(
         "Støder du på fejl i data eller vil du have hjælp? Så skriv til data@gravercentret.dk"
@@ -390,10 +491,36 @@ def write_markdown_sidebar(how_we_did=False):
 
 def format_and_display_data(dataframe):
     return dataframe.with_columns(
-        pl.col("Markedsværdi (DKK)")
-        .map_elements(format_number_european, return_dtype=pl.Utf8)
-        .alias("Markedsværdi (DKK)")
+        format_number_european_expr(pl.col("Markedsværdi (DKK)")).alias("Markedsværdi (DKK)")
+    )
+
+
+# Number of rows shown per page in the data tables
+PAGE_SIZE = 100
+
+
+def select_page(n_rows, page_size=PAGE_SIZE):
+    """
+    Show a page selector for a table with n_rows rows and return the row offset of the chosen page.
+    """
+    n_pages = max(1, (n_rows + page_size - 1) // page_size)
+    if n_pages == 1:
+        return 0
+
+    page = st.number_input(
+        f"Side (af {format_number_european(n_pages)}):",
+        min_value=1,
+        max_value=n_pages,
+        value=1,
+        step=1,
+        help=f"Tabellen viser {page_size} investeringer ad gangen. Hele listen kan downloades til Excel.",
+    )
+    offset = (page - 1) * page_size
+    st.caption(
+        f"Viser investering {format_number_european(offset + 1)}-"
+        f"{format_number_european(min(offset + page_size, n_rows))} af {format_number_european(n_rows)}."
     )
+    return offset
 
 
 def display_dataframe(df):
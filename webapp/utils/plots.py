@@ -4,13 +4,30 @@ import streamlit as st
 from utils.data_processing import format_number_european, round_to_million_or_billion
 
 
-def create_pie_chart(filtered_df):
-    # Group the data by 'Type' and sum the 'Markedsværdi (DKK)'
-    type_distribution = (
-        filtered_df.group_by("Type")
+def get_type_distribution(df):
+    # Group the data by 'Type' and sum the 'Markedsværdi (DKK)'. Returns a LazyFrame, so it can
+    # be collected together with other queries on the same data
+    return (
+        df.lazy()
+        .group_by("Type")
         .agg(pl.col("Markedsværdi (DKK)").sum().alias("Total Markedsværdi"))
-        .to_pandas()
-    )  # Convert to pandas for plotting
+        .with_columns(pl.col("Type").cast(pl.Utf8))  # Plain strings for the pandas replace below
+    )
+
+
+def create_pie_chart(type_distribution):
+    # The chart only depends on the few (Type, sum) rows, so the figure is cached on those
+    type_totals = tuple(type_distribution.sort("Type", nulls_last=True).iter_rows())
+    st.plotly_chart(build_pie_chart(type_totals))
+
+
+@st.cache_data(show_spinner=False)
+def build_pie_chart(type_totals):
+    type_distribution = pl.DataFrame(
+        list(type_totals),
+        schema={"Type": pl.Utf8, "Total Markedsværdi": pl.Float64},
+        orient="row",
+    ).to_pandas()  # Convert to pandas for plotting
 
     # Drop rows with missing values (NaN) in 'Total Markedsværdi' or 'Type'
     type_distribution = type_distribution.dropna(subset=["Total Markedsværdi", "Type"])
@@ -96,4 +113,4 @@ def create_pie_chart(filtered_df):
     )
     # fig.layout.yaxis.tickformat = ',.0%'
 
-    st.plotly_chart(fig)
+    return fig